@@ -9,30 +9,80 @@ Per rdmaX:
 - Use server rdmaX IP to force traffic on the intended interface
 - Start ib_write_bw server bound to mlx5 device
 - Run client bound to peer mlx5 device
+- Pin both ends to the NIC's NUMA node when numactl is available
+- Independent NICs are tested concurrently (one worker per rdmaX)
 - Robustly parse BW average[Gb/sec]
 - Print results in a table
+
+With --bidirectional each netdev is also tested in reverse (server on the peer,
+client on server_host) at the same time. bw_avg_gbps_a2b is the usual run
+(server on server_host, client on peer_host) and bw_avg_gbps_b2a the reversed one.
+
+Environment overrides:
+- RDMA_BW_QPS        queue pairs per test (ib_write_bw -q, default 4)
+- RDMA_BW_TX_DEPTH   send queue depth (--tx-depth, default 512; perftest's own is 128)
+- RDMA_BW_GID_INDEX  GID index (-x, default: perftest's choice)
 """
 
+import argparse
+import functools
+import json
+import os
 import re
+import select
 import shlex
 import signal
 import subprocess
 import sys
 import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import Dict, List, Optional, Tuple
+from typing import Deque, Dict, List, Optional, Set, Tuple
 
 # ---------------------------
 # Regex / constants
 # ---------------------------
 
 IBDEV_LINE_RE = re.compile(
-    r"^(?P<dev>mlx5_\d+)\s+port\s+(?P<port>\d+)\s+==>\s+(?P<netdev>\S+)\s+\((?P<state>Up|Down)\)$",
-    re.IGNORECASE,
+    r"^[ \t]*(?P<dev>mlx5_\d+)[ \t]+port[ \t]+(?P<port>\d+)[ \t]+==>[ \t]+(?P<netdev>\S+)[ \t]+\((?P<state>Up|Down)\)[ \t]*$",
+    re.IGNORECASE | re.MULTILINE,
 )
 
+_BW_HDR_RE = re.compile(r"BW average\[Gb/sec\]")
+# First data row after the header: "#bytes #iterations BW-peak BW-average ..."
+_ROW_RE = re.compile(r"^[ \t]*\d+[ \t]+\d+[ \t]+\S+[ \t]+(\d+\.\d+)", re.MULTILINE)
+_CLIENT_PID_RE = re.compile(r"^client_pid=(\d+)$")
+
 SERVER_LOG_DIR = "/tmp"
+DEFAULT_QPS = 4
+DEFAULT_TX_DEPTH = 512
+DISCOVERY_CACHE_DIR = os.path.expanduser("~/.cache/rdma_per_link_bw")
+
+SSH_BASE_OPTS = [
+    "-o", "BatchMode=yes",
+    "-o", "StrictHostKeyChecking=accept-new",
+]
+
+# Multiplex short control commands to a host over one persistent control
+# connection so only the first call pays the TCP + auth handshake.
+SSH_OPTS = [
+    *SSH_BASE_OPTS,
+    "-o", "ControlMaster=auto",
+    "-o", "ControlPersist=120s",
+    "-o", "ControlPath=/tmp/ssh-oci-%C",
+]
+
+# sshd refuses sessions beyond MaxSessions (default 10) on one multiplexed
+# connection, and bare-metal GPU shapes expose 16 rdmaX interfaces. The
+# long-running ib_write_bw clients therefore get their own connection, and
+# concurrent multiplexed commands are capped per host below that limit.
+CLIENT_SSH_OPTS = [*SSH_BASE_OPTS, "-o", "ControlMaster=no", "-S", "none"]
+MUX_SESSIONS_PER_HOST = 8
+
+_mux_slots: Dict[str, threading.BoundedSemaphore] = {}
+_mux_slots_lock = threading.Lock()
 
 # ---------------------------
 # Data structures
@@ -44,19 +94,33 @@ class MapEntry:
     port: int
     netdev: str
     state: str
+    numa_node: int = -1
 
 # ---------------------------
 # Utility helpers
 # ---------------------------
 
 def run(cmd: List[str], timeout: int = 60) -> Tuple[int, str, str]:
-    p = subprocess.run(cmd, text=True, capture_output=True, timeout=timeout)
+    # Never hand the terminal to children: ssh forwards stdin to the remote
+    # side, and discovery runs in the background while input() is waiting.
+    p = subprocess.run(cmd, text=True, capture_output=True, stdin=subprocess.DEVNULL, timeout=timeout)
     return p.returncode, p.stdout.strip(), p.stderr.strip()
 
 def ssh(host: str, remote_cmd: str, timeout: int = 60) -> Tuple[int, str, str]:
-    return run(
-        ["ssh", "-o", "BatchMode=yes", "-o", "StrictHostKeyChecking=accept-new", host, remote_cmd],
-        timeout=timeout,
+    with _mux_slots_lock:
+        slot = _mux_slots.setdefault(host, threading.BoundedSemaphore(MUX_SESSIONS_PER_HOST))
+    with slot:
+        return run(["ssh", *SSH_OPTS, host, remote_cmd], timeout=timeout)
+
+def prime_ssh_master(host: str) -> None:
+    # Start the control master detached with stdio on /dev/null; letting the
+    # first captured ssh() become the master can leave its pipes held open.
+    subprocess.run(
+        ["ssh", *SSH_OPTS, "-Nf", host],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        timeout=30,
     )
 
 def must(rc: int, out: str, err: str, msg: str) -> str:
@@ -64,11 +128,14 @@ def must(rc: int, out: str, err: str, msg: str) -> str:
         raise RuntimeError(f"{msg} failed (rc={rc})\nSTDOUT:\n{out}\nSTDERR:\n{err}")
     return out
 
-def expand_nodelist(nodelist: str) -> List[str]:
-    rc, out, err = run(["scontrol", "show", "hostnames", nodelist], timeout=10)
+@functools.lru_cache(maxsize=64)
+def expand_nodelist(nodelist: str) -> Tuple[str, ...]:
+    # scontrol accepts a comma-joined list of hostlist expressions, so callers
+    # with several groups should join them and expand in one call.
+    rc, out, err = run(["scontrol", "show", "hostnames", nodelist], timeout=15)
     if rc != 0:
         raise RuntimeError(f"scontrol show hostnames failed for {nodelist}\nSTDOUT:\n{out}\nSTDERR:\n{err}")
-    return [line.strip() for line in out.splitlines() if line.strip()]
+    return tuple(line.strip() for line in out.splitlines() if line.strip())
 
 def get_idle_nodes(partition: Optional[str], exclude: Optional[str] = None) -> List[str]:
     cmd = ["sinfo", "-h", "-o", "%N %t"]
@@ -78,7 +145,7 @@ def get_idle_nodes(partition: Optional[str], exclude: Optional[str] = None) -> L
     if rc != 0:
         raise RuntimeError(f"sinfo failed\nSTDOUT:\n{out}\nSTDERR:\n{err}")
 
-    idle_nodes: List[str] = []
+    idle_lists: List[str] = []
     for line in out.splitlines():
         line = line.strip()
         if not line:
@@ -89,133 +156,318 @@ def get_idle_nodes(partition: Optional[str], exclude: Optional[str] = None) -> L
         nodelist, state = parts[0], parts[1].lower()
         if not state.startswith("idle"):
             continue
-        idle_nodes.extend(expand_nodelist(nodelist))
-    nodes = sorted(set(idle_nodes))
+        idle_lists.append(nodelist)
+    if not idle_lists:
+        return []
+    idle_nodes: Set[str] = set(expand_nodelist(",".join(idle_lists)))
     if exclude:
-        nodes = [n for n in nodes if n != exclude]
-    return nodes
+        idle_nodes.discard(exclude)
+    return sorted(idle_nodes)
 
 # ---------------------------
 # RDMA discovery
 # ---------------------------
 
 def parse_ibdev2netdev(text: str) -> List[MapEntry]:
-    entries: List[MapEntry] = []
-    for line in text.splitlines():
-        line = line.strip()
-        m = IBDEV_LINE_RE.match(line)
-        if not m:
-            continue
-        entries.append(
-            MapEntry(
-                dev=m.group("dev"),
-                port=int(m.group("port")),
-                netdev=m.group("netdev"),
-                state=m.group("state"),
-            )
+    return [
+        MapEntry(
+            dev=m.group("dev"),
+            port=int(m.group("port")),
+            netdev=m.group("netdev"),
+            state=m.group("state"),
         )
-    return entries
+        for m in IBDEV_LINE_RE.finditer(text)
+    ]
 
 def is_rdma_netdev(netdev: str) -> bool:
     return netdev.lower().startswith(("rdma", "ib"))
 
-def get_ipv4(host: str, netdev: str) -> Optional[str]:
-    rc, out, _ = ssh(
+def parse_ipv4_addrs(text: str) -> Dict[str, str]:
+    """Parse `ip -4 -o addr show | awk '{print $2, $4}'` into {netdev: ipv4}."""
+    addrs: Dict[str, str] = {}
+    for line in text.splitlines():
+        parts = line.split()
+        if len(parts) < 2:
+            continue
+        # Keep the first address per netdev, like `head -n1` did.
+        addrs.setdefault(parts[0], parts[1].split("/", 1)[0])
+    return addrs
+
+def parse_numa_nodes(text: str) -> Dict[str, int]:
+    """Parse "<ibdev> <numa_node>" lines into {ibdev: numa_node}."""
+    nodes: Dict[str, int] = {}
+    for line in text.splitlines():
+        parts = line.split()
+        if len(parts) == 2 and parts[1].lstrip("-").isdigit():
+            nodes[parts[0]] = int(parts[1])
+    return nodes
+
+def parse_port_states(text: str) -> Dict[Tuple[str, int], str]:
+    """Parse "<ibdev> <port> <n>: <STATE>" lines into {(ibdev, port): "Up"|"Down"}."""
+    states: Dict[Tuple[str, int], str] = {}
+    for line in text.splitlines():
+        parts = line.split()
+        if len(parts) >= 3 and parts[1].isdigit():
+            states[(parts[0], int(parts[1]))] = "Up" if parts[-1].upper() == "ACTIVE" else "Down"
+    return states
+
+def split_sections(text: str) -> List[str]:
+    """Split remote output on '---' separator lines; empty sections are kept."""
+    sections: List[List[str]] = [[]]
+    for line in text.splitlines():
+        if line.strip() == "---":
+            sections.append([])
+        else:
+            sections[-1].append(line)
+    return ["\n".join(lines) for lines in sections]
+
+def load_discovery_cache(host: str) -> Optional[Tuple[str, List[MapEntry]]]:
+    try:
+        with open(os.path.join(DISCOVERY_CACHE_DIR, f"{host}.json")) as f:
+            data = json.load(f)
+        # Only the mapping is cached; link state is filled in fresh on each run.
+        entries = [MapEntry(dev=e["dev"], port=e["port"], netdev=e["netdev"], state="Down") for e in data["entries"]]
+        return data["boot_id"], entries
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+def save_discovery_cache(host: str, boot_id: str, entries: List[MapEntry]) -> None:
+    path = os.path.join(DISCOVERY_CACHE_DIR, f"{host}.json")
+    try:
+        os.makedirs(DISCOVERY_CACHE_DIR, exist_ok=True)
+        with open(path + ".tmp", "w") as f:
+            json.dump(
+                {"boot_id": boot_id, "entries": [{"dev": e.dev, "port": e.port, "netdev": e.netdev} for e in entries]},
+                f,
+            )
+        os.replace(path + ".tmp", path)
+    except OSError:
+        pass
+
+def discover_host(host: str) -> Tuple[List[MapEntry], Dict[str, str]]:
+    """Fetch interface IPv4s, NIC NUMA nodes and ibdev2netdev in a single ssh round-trip.
+
+    The dev -> netdev mapping only changes across reboots, so it is cached on disk
+    keyed by the host's boot_id and only re-read remotely when the boot_id differs.
+    IPs, port states and NUMA nodes can change without a reboot and are cheap to
+    read, so they are fetched on every run.
+    """
+    cached = load_discovery_cache(host)
+    # An empty cached map is more likely a transient ibdev2netdev failure than a
+    # host without HCAs; don't pin it for the rest of the boot.
+    if cached and not cached[1]:
+        cached = None
+    known_boot_id = cached[0] if cached else ""
+    rc, out, err = ssh(
         host,
-        f"ip -4 -o addr show dev {shlex.quote(netdev)} | awk '{{print $4}}' | cut -d/ -f1 | head -n1",
-        timeout=15,
+        "b=$(cat /proc/sys/kernel/random/boot_id) && echo \"$b\" && echo '---' && "
+        "ip -4 -o addr show | awk '{print $2, $4}' && echo '---' && "
+        # NUMA nodes are only useful if we can pin with numactl.
+        "if command -v numactl >/dev/null; then "
+        "for d in /sys/class/infiniband/*; do echo \"${d##*/} $(cat $d/device/numa_node)\"; done; fi && "
+        "echo '---' && for f in /sys/class/infiniband/*/ports/*/state; do [ -r \"$f\" ] || continue; "
+        "p=${f%/state}; d=${p%/ports/*}; echo \"${d##*/} ${p##*/} $(cat $f)\"; done && "
+        f"if [ \"$b\" != {shlex.quote(known_boot_id)} ]; then echo '---' && ibdev2netdev; fi",
+        timeout=30,
     )
-    if rc != 0:
-        return None
-    return out.strip() if out.strip() else None
+    must(rc, out, err, f"ibdev2netdev/ip discovery on {host}")
+    sections = split_sections(out)
+    boot_id, addr_text, numa_text, state_text = (sections + ["", "", ""])[:4]
+    boot_id = boot_id.strip()
+    if cached and len(sections) == 4:
+        entries = cached[1]
+    else:
+        entries = parse_ibdev2netdev(sections[4] if len(sections) > 4 else "")
+        save_discovery_cache(host, boot_id, entries)
+
+    states = parse_port_states(state_text)
+    for e in entries:
+        e.state = states.get((e.dev, e.port), e.state)
+
+    numa = parse_numa_nodes(numa_text)
+    for e in entries:
+        e.numa_node = numa.get(e.dev, -1)
+    return entries, parse_ipv4_addrs(addr_text)
+
+def connect_and_discover(host: str) -> Tuple[List[MapEntry], Dict[str, str]]:
+    prime_ssh_master(host)
+    return discover_host(host)
 
 # ---------------------------
 # Perftest helpers
 # ---------------------------
 
-def parse_bw_average_gbits(text: str) -> Optional[float]:
-    lines = text.splitlines()
-    header_idx = None
-
-    for i, line in enumerate(lines):
-        if "BW average[Gb/sec]" in line:
-            header_idx = i
-            break
-
-    if header_idx is None:
-        return None
-
-    for j in range(header_idx + 1, min(header_idx + 10, len(lines))):
-        row = lines[j].strip()
-        if not row or set(row) <= {"-", " "}:
-            continue
-        parts = row.split()
-        if len(parts) >= 4:
-            try:
-                return float(parts[3])
-            except ValueError:
-                pass
-    return None
-
-def start_server(host: str, dev: str, port: int, tcp_port: int) -> Tuple[int, str]:
+def numa_prefix(numa_node: int) -> str:
+    # Keep ib_write_bw's CPU and buffers on the NIC's socket; cross-NUMA
+    # traffic caps RDMA bandwidth well below line rate. This goes in front of
+    # sudo: the policy is inherited across exec, so numactl needs no sudoers
+    # grant of its own, and $! still names the process that becomes sudo.
+    if numa_node < 0:
+        return ""
+    return f"numactl --cpunodebind={numa_node} --membind={numa_node} -- "
+
+def env_int(name: str, default: Optional[int], minimum: int) -> Optional[int]:
+    raw = os.environ.get(name, "").strip()
+    if not raw:
+        return default
+    try:
+        value = int(raw)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer, got {raw!r}") from None
+    if value < minimum:
+        raise ValueError(f"{name} must be >= {minimum}, got {value}")
+    return value
+
+def tuning_opts(qps: int, tx_depth: int, gid_index: Optional[int]) -> str:
+    # A single QP can't saturate 200/400G ConnectX links; spread the load over
+    # several QPs with a deeper send queue. Both ends must agree on these.
+    opts = f"-q {qps} --tx-depth={tx_depth}"
+    if gid_index is not None:
+        opts += f" -x {gid_index}"
+    return opts
+
+def start_server(
+    host: str,
+    dev: str,
+    port: int,
+    tcp_port: int,
+    numa_node: int = -1,
+    qps: int = DEFAULT_QPS,
+    tx_depth: int = DEFAULT_TX_DEPTH,
+    gid_index: Optional[int] = None,
+) -> Tuple[int, str]:
     log_path = f"{SERVER_LOG_DIR}/ib_write_bw_{dev}_p{port}_{tcp_port}.log"
+    # sshd already runs this through the remote user's shell; no login shell
+    # wrapper, so profile scripts aren't sourced on every call.
     cmd = (
-        "bash -lc " + shlex.quote(
-            f"sudo -n ib_write_bw -d {dev} -i {port} -p {tcp_port} "
-            f"--report_gbits --run_infinitely > {log_path} 2>&1 & echo $!"
-        )
+        f"{numa_prefix(numa_node)}sudo -n ib_write_bw -d {dev} -i {port} -p {tcp_port} -F "
+        f"{tuning_opts(qps, tx_depth, gid_index)} --report_gbits --run_infinitely > {log_path} 2>&1 & echo $!"
     )
     rc, out, err = ssh(host, cmd, timeout=20)
     must(rc, out, err, "Starting server")
     return int(out.strip()), log_path
 
-def stop_pid(host: str, pid: int) -> None:
-    ssh(host, f"sudo -n kill -9 {pid} >/dev/null 2>&1 || true", timeout=10)
-
-def run_client(
-    host: str,
+def stop_pids(host: str, pids: List[int], sweep: bool = False, sig: str = "KILL") -> None:
+    if not pids and not sweep:
+        return
+    cmds = []
+    if pids:
+        ids = " ".join(str(p) for p in pids)
+        # The recorded pid may be sudo itself, which cannot relay SIGKILL to
+        # ib_write_bw, so signal its children as well.
+        cmds.append(f"sudo -n pkill -{sig} -P {ids.replace(' ', ',')} >/dev/null 2>&1")
+        cmds.append(f"sudo -n kill -{sig} {ids} >/dev/null 2>&1")
+    if sweep:
+        cmds.append("sudo -n pkill -f ib_write_bw >/dev/null 2>&1")
+    ssh(host, "; ".join(cmds) + "; true", timeout=10)
+
+def client_cmd(
     dev: str,
     port: int,
     server_ip: str,
     tcp_port: int,
     duration: int,
-) -> Tuple[Optional[float], str]:
-
-    cmd = (
-        "bash -lc " + shlex.quote(
-            f"sudo -n ib_write_bw -d {dev} -i {port} -p {tcp_port} "
-            f"{server_ip} --report_gbits -D {duration} 2>&1"
-        )
+    numa_node: int = -1,
+    qps: int = DEFAULT_QPS,
+    tx_depth: int = DEFAULT_TX_DEPTH,
+    gid_index: Optional[int] = None,
+) -> str:
+    # Background the client and report its pid so the controller can stop it
+    # remotely once the summary row has been read or the run times out.
+    return (
+        f"{numa_prefix(numa_node)}sudo -n ib_write_bw -d {dev} -i {port} -p {tcp_port} -F "
+        f"{tuning_opts(qps, tx_depth, gid_index)} {server_ip} --report_gbits -D {duration} 2>&1 & echo client_pid=$!; wait $!"
     )
-    rc, out, err = ssh(host, cmd, timeout=duration + 30)
-    output = (out + "\n" + err).strip()
 
-    bw = parse_bw_average_gbits(output)
-    return bw, output
-
-def run_client_with_spinner(
+def run_client(
     host: str,
     dev: str,
     port: int,
     server_ip: str,
     tcp_port: int,
     duration: int,
+    numa_node: int = -1,
+    qps: int = DEFAULT_QPS,
+    tx_depth: int = DEFAULT_TX_DEPTH,
+    gid_index: Optional[int] = None,
+    spinner: bool = False,
 ) -> Tuple[Optional[float], str]:
-    stop = threading.Event()
-
-    def spinner() -> None:
-        while not stop.is_set():
-            print(".", end="", flush=True)
-            time.sleep(1)
 
-    t = threading.Thread(target=spinner, daemon=True)
-    t.start()
+    # Stream the client output so memory stays bounded to the tail we may
+    # need to print on failure, parsing the BW row as soon as it arrives.
+    proc = subprocess.Popen(
+        ["ssh", *CLIENT_SSH_OPTS, host, client_cmd(dev, port, server_ip, tcp_port, duration, numa_node, qps, tx_depth, gid_index)],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+    )
+    timed_out = threading.Event()
+
+    def on_timeout() -> None:
+        timed_out.set()
+        proc.kill()
+
+    timer = threading.Timer(duration + 30, on_timeout)
+    timer.start()
+
+    tail: Deque[str] = deque(maxlen=64)
+    bw: Optional[float] = None
+    remote_pid: Optional[int] = None
+    seen_hdr = False
+
+    def feed(line: str) -> bool:
+        """Consume one output line; True once the summary row has been parsed."""
+        nonlocal bw, remote_pid, seen_hdr
+        if remote_pid is None:
+            m = _CLIENT_PID_RE.match(line)
+            if m:
+                remote_pid = int(m.group(1))
+                return False
+        tail.append(line)
+        if not seen_hdr:
+            seen_hdr = _BW_HDR_RE.search(line) is not None
+            return False
+        m = _ROW_RE.match(line)
+        if m:
+            bw = float(m.group(1))
+        return bw is not None
+
+    fd = proc.stdout.fileno()
+    pending = b""
+    done = False
     try:
-        return run_client(host, dev, port, server_ip, tcp_port, duration)
+        while not done:
+            # ib_write_bw is silent for the whole run, so with the spinner we
+            # wake once a second to print a tick instead of blocking on read.
+            if spinner and not select.select([fd], [], [], 1.0)[0]:
+                print(".", end="", flush=True)
+                continue
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                if pending:
+                    feed(pending.decode(errors="replace"))
+                break
+            *lines, pending = (pending + chunk).split(b"\n")
+            for raw in lines:
+                if feed(raw.decode(errors="replace")):
+                    done = True
+                    break
+        # Either we have the summary or the client gave up; don't wait for
+        # ib_write_bw's trailing output or ssh teardown.
+        finished = proc.poll() is not None
+        if not finished:
+            proc.terminate()
+        proc.wait()
+        proc.stdout.close()
     finally:
-        stop.set()
-        t.join(timeout=2)
-        print("", flush=True)
+        timer.cancel()
+        if spinner:
+            print("", flush=True)
+
+    if remote_pid is not None and (not finished or timed_out.is_set()):
+        stop_pids(host, [remote_pid], sig="TERM")
+
+    return bw, "\n".join(tail).strip()
 
 # ---------------------------
 # Display helpers
@@ -223,24 +475,55 @@ def run_client_with_spinner(
 
 def print_table(rows: List[Dict[str, str]]) -> None:
     cols = list(rows[0].keys())
-    widths = {c: max(len(c), max(len(str(r[c])) for r in rows)) for c in cols}
+    cells = [tuple(str(r[c]) for c in cols) for r in rows]
+    widths = [max(len(c), *(len(row[i]) for row in cells)) for i, c in enumerate(cols)]
+    fmt = " | ".join(f"{{:<{w}}}" for w in widths)
 
-    print(" | ".join(c.ljust(widths[c]) for c in cols))
-    print("-+-".join("-" * widths[c] for c in cols))
+    print(fmt.format(*cols))
+    print("-+-".join("-" * w for w in widths))
 
-    for r in rows:
-        print(" | ".join(str(r[c]).ljust(widths[c]) for c in cols))
+    for row in cells:
+        print(fmt.format(*row))
 
 # ---------------------------
 # Main
 # ---------------------------
 
 def main() -> int:
+    parser = argparse.ArgumentParser(description="Per-RDMA-interface ib_write_bw bandwidth test.")
+    parser.add_argument(
+        "--bidirectional",
+        action="store_true",
+        help="also run the reverse direction (server on peer_host) concurrently for each netdev",
+    )
+    args = parser.parse_args()
+
+    # perftest tuning, overridable from the environment; validated up front so
+    # a typo fails before any prompts or remote work.
+    try:
+        tuning = {
+            "qps": env_int("RDMA_BW_QPS", DEFAULT_QPS, 1),
+            "tx_depth": env_int("RDMA_BW_TX_DEPTH", DEFAULT_TX_DEPTH, 1),
+            "gid_index": env_int("RDMA_BW_GID_INDEX", None, 0),
+        }
+    except ValueError as e:
+        parser.error(str(e))
+
     server = input("server_host (runs server): ").strip()
+
+    # Overlap server discovery and the default idle-node lookup with the
+    # remaining prompts; results are collected once the user has answered.
+    prefetch = ThreadPoolExecutor(max_workers=3)
+    server_future = prefetch.submit(connect_and_discover, server)
+    idle_future = prefetch.submit(get_idle_nodes, None, server)
+
     peer = input("peer_host   (runs client) [or 'idle']: ").strip()
     if not peer or peer.lower() == "idle":
         partition = input("partition for idle lookup (optional): ").strip()
-        idle_nodes = get_idle_nodes(partition or None, exclude=server)
+        if partition:
+            idle_nodes = get_idle_nodes(partition, exclude=server)
+        else:
+            idle_nodes = idle_future.result()
         if not idle_nodes:
             raise RuntimeError("No idle nodes found")
         print("\nIdle nodes:")
@@ -257,13 +540,13 @@ def main() -> int:
                 raise RuntimeError("Selection not in idle node list")
             peer = sel
 
-    rc, out, err = ssh(server, "ibdev2netdev")
-    server_map = must(rc, out, err, "ibdev2netdev server")
-    rc, out, err = ssh(peer, "ibdev2netdev")
-    peer_map = must(rc, out, err, "ibdev2netdev peer")
+    peer_future = prefetch.submit(connect_and_discover, peer)
+    server_map, server_ips = server_future.result()
+    peer_map, peer_ips = peer_future.result()
+    prefetch.shutdown(wait=False)
 
-    server_entries = [e for e in parse_ibdev2netdev(server_map) if e.state == "Up" and is_rdma_netdev(e.netdev)]
-    peer_entries = [e for e in parse_ibdev2netdev(peer_map) if e.state == "Up" and is_rdma_netdev(e.netdev)]
+    server_entries = [e for e in server_map if e.state == "Up" and is_rdma_netdev(e.netdev)]
+    peer_entries = [e for e in peer_map if e.state == "Up" and is_rdma_netdev(e.netdev)]
 
     srv_by_netdev = {e.netdev: e for e in server_entries}
     peer_by_netdev = {e.netdev: e for e in peer_entries}
@@ -273,51 +556,100 @@ def main() -> int:
     if not common_netdevs:
         raise RuntimeError("No common RDMA netdevs between server and peer")
 
-    results = []
-    pids = []
+    # Server pids per host; in bidirectional mode the peer runs servers too.
+    pids: Dict[str, List[int]] = {server: [], peer: []}
+    pids_lock = threading.Lock()
 
-    def cleanup(*_):
-        for pid in pids:
-            stop_pid(server, pid)
-        ssh(server, "sudo -n pkill -f ib_write_bw >/dev/null 2>&1 || true")
+    def cleanup(*_, force_sweep: bool = False):
+        with pids_lock:
+            recorded = {host: list(host_pids) for host, host_pids in pids.items()}
+            for host_pids in pids.values():
+                host_pids.clear()
+        # On an interrupted run a server may have started without its pid
+        # being recorded yet, so also sweep by name.
+        for host, host_pids in recorded.items():
+            if host == server or args.bidirectional:
+                stop_pids(host, host_pids, sweep=force_sweep)
 
-    signal.signal(signal.SIGINT, cleanup)
-    signal.signal(signal.SIGTERM, cleanup)
+    signal.signal(signal.SIGINT, lambda *_: cleanup(force_sweep=True))
+    signal.signal(signal.SIGTERM, lambda *_: cleanup(force_sweep=True))
 
     base_port = 18515
     duration = 10
 
     total = len(common_netdevs)
-    for idx, netdev in enumerate(common_netdevs):
-        srv = srv_by_netdev[netdev]
-        cli = peer_by_netdev[netdev]
-        ip = get_ipv4(server, netdev)
+    # Dots from several concurrent clients would interleave, so only show the
+    # spinner when there is a single one-way test.
+    spinner = total == 1 and not args.bidirectional
+
+    def run_direction(
+        srv_host: str,
+        srv: MapEntry,
+        cli_host: str,
+        cli: MapEntry,
+        ip: str,
+        tcp_port: int,
+    ) -> Tuple[Optional[float], str]:
+        pid, _ = start_server(srv_host, srv.dev, srv.port, tcp_port, srv.numa_node, **tuning)
+        with pids_lock:
+            pids[srv_host].append(pid)
+        time.sleep(0.5)
 
-        if not ip:
-            continue
+        # The server is left idling until cleanup() tears every server down in
+        # a single ssh, keeping the kill off each worker's critical path.
+        return run_client(cli_host, cli.dev, cli.port, ip, tcp_port, duration, cli.numa_node, spinner=spinner, **tuning)
 
-        tcp_port = base_port + idx
-        print(f"[{idx + 1}/{total}] testing {netdev} (server {server} -> peer {peer})...", flush=True)
-        pid, _ = start_server(server, srv.dev, srv.port, tcp_port)
-        pids.append(pid)
-        time.sleep(0.5)
+    def report(label: str, bw: Optional[float], output: str) -> str:
+        if bw is None:
+            print(f"\nFAIL {label} – client output tail:\n\n" + "\n".join(output.rsplit("\n", 30)[-30:]), flush=True)
+            return "FAIL"
+        print(f"done {label}: {bw:.2f} Gb/sec", flush=True)
+        return f"{bw:.2f}"
 
-        bw, output = run_client_with_spinner(peer, cli.dev, cli.port, ip, tcp_port, duration)
-        stop_pid(server, pid)
+    def test_one(netdev: str, idx: int) -> Optional[Dict[str, str]]:
+        srv = srv_by_netdev[netdev]
+        cli = peer_by_netdev[netdev]
+        ip = server_ips.get(netdev)
+        peer_ip = peer_ips.get(netdev)
 
-        results.append({
+        if not ip or (args.bidirectional and not peer_ip):
+            return None
+
+        row = {
             "netdev": netdev,
             "server_dev": f"{srv.dev}:{srv.port}",
             "server_ip": ip,
             "peer_dev": f"{cli.dev}:{cli.port}",
-            "bw_avg_gbps": f"{bw:.2f}" if bw is not None else "FAIL",
-        })
+        }
 
-        if bw is None:
-            print(f"\nFAIL {netdev} – client output tail:\n")
-            print("\n".join(output.splitlines()[-30:]))
-
-    cleanup()
+        # tcp_port (and therefore the server log path) is unique per netdev
+        # and direction, so concurrent runs never collide.
+        tcp_port = base_port + idx
+        if not args.bidirectional:
+            row["bw_avg_gbps"] = report(netdev, *run_direction(server, srv, peer, cli, ip, tcp_port))
+            return row
+
+        # Links are full duplex: run both directions at once, with a second
+        # server on the peer driven by a client on the server host.
+        with ThreadPoolExecutor(max_workers=2) as pair:
+            a2b = pair.submit(run_direction, server, srv, peer, cli, ip, tcp_port)
+            b2a = pair.submit(run_direction, peer, cli, server, srv, peer_ip, tcp_port + total)
+            row["peer_ip"] = peer_ip
+            row["bw_avg_gbps_a2b"] = report(f"{netdev} a2b", *a2b.result())
+            row["bw_avg_gbps_b2a"] = report(f"{netdev} b2a", *b2a.result())
+        return row
+
+    mode = "bidirectional" if args.bidirectional else f"server {server} -> peer {peer}"
+    print(f"testing {total} netdevs in parallel ({mode})...", flush=True)
+    # Servers stay up until cleanup(), so tear them down even if a worker
+    # raises; sweep by name then, as a server may have started unrecorded.
+    completed = False
+    try:
+        with ThreadPoolExecutor(max_workers=total) as executor:
+            results = [r for r in executor.map(test_one, common_netdevs, range(total)) if r is not None]
+        completed = True
+    finally:
+        cleanup(force_sweep=not completed)
 
     print("\nResults:\n")
     print_table(results)